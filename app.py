@@ -4,7 +4,22 @@ import google.genai.types as types
 from google import genai
 from io import BytesIO
 from PIL import Image
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import hashlib
 import json
+import orjson
+import os
+from pathlib import Path
+import re
+import time
+import uuid
+
+try:
+    import uvloop  # Faster event loop for the concurrent API calls; not available on Windows
+except ImportError:
+    uvloop = None
 
 # Initialize global variables properly
 if 'client' not in st.session_state:
@@ -12,6 +27,331 @@ if 'client' not in st.session_state:
 
 IMAGE_MODEL = "gemini-2.5-flash-image-preview"
 REVIEW_MODEL = "gemini-2.0-flash"  # For image analysis
+IMAGE_CONFIG = types.GenerateContentConfig(response_modalities=["IMAGE"])
+# The reviewer answers with a bare JSON list of fix strings, so no fence-stripping is needed
+REVIEW_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=list[str],
+    max_output_tokens=512,
+    temperature=0.2
+)
+REVIEW_CONFIG_VERSION = 2  # Part of the review cache key; bump whenever REVIEW_CONFIG or the reviewer's output changes
+IMAGE_CACHE_SIZE = 32  # Max memoized (prompt, reference) generations per session; older ones are re-read from disk
+REVIEW_CACHE_SIZE = 256  # Max memoized (image, concept) reviews per session
+REFERENCE_MAX_SIZE = (768, 768)  # Reference images are downscaled to this before upload
+THUMB_SIZE = (256, 256)  # Gallery thumbnails; full-size images are only shown in the scene and edit views
+GALLERY_COLUMNS = 3
+EXAMPLE_IMAGES = [  # (path, caption), shown in rows of three
+    ("./GeneratedImages/BaseImage1.jpg", "Base Character 1"),
+    ("./GeneratedImages/GeneratedImage1-3.jpg", "Human Digestive System"),
+    ("./GeneratedImages/GeneratedImage1-4.jpg", "Newton's Laws of Motion"),
+    ("./GeneratedImages/BaseImage2.jpg", "Base Character 2"),
+    ("./GeneratedImages/GeneratedImage2-1.jpg", "Water Cycle Scene"),
+    ("./GeneratedImages/GeneratedImage2-2.jpg", "Ancient Roman Marketplace"),
+]
+UPLOAD_PASSTHROUGH_BYTES = 1024 * 1024  # JPEG uploads up to this size are used without decoding
+# Encoder settings for every JPEG we send to Gemini or keep in the session (subsampling=2 is 4:2:0)
+JPEG_SAVE_OPTIONS = {"quality": 85, "optimize": True, "progressive": True, "subsampling": 2}
+RATE_LIMIT_RE = re.compile(r"429|quota|\b(?:rpm|tpm|rpd)\b", re.IGNORECASE)
+MODEL_ERROR_RE = re.compile(r"400.*model|model.*400", re.IGNORECASE | re.DOTALL)
+SPELLING_FIX_RE = re.compile(r"\s*Fix spelling", re.IGNORECASE)
+MINOR_FIX_LIMIT = 2  # Up to this many spelling-only fixes don't trigger a re-generation
+CACHE_DIR = Path("./.cache")  # Generated images survive page reloads here
+SESSION_ID_RE = re.compile(r"[0-9a-f]{32}")  # Per-browser disk cache id, kept in the ?sid= query parameter
+SESSION_INDEX_MAX_AGE = 7 * 24 * 3600  # Session indexes untouched for this many seconds are deleted
+ORPHAN_IMAGE_GRACE = 3600  # Unreferenced images younger than this are kept, in case their index is being written
+PRUNE_MARKER = CACHE_DIR / ".last_prune"  # Touched on each cache prune; see prune_disk_cache_if_due
+PRUNE_INTERVAL = 3600  # Seconds between cache prunes across all sessions
+RESPONSE_CACHE_DIR = CACHE_DIR / "responses"  # API responses keyed by (model, prompt, reference)
+RESPONSE_CACHE_MAX_BYTES = 512 * 1024 * 1024  # Least recently used responses are deleted past this total size
+RESPONSE_CACHE_MAX_AGE = 30 * 24 * 3600  # Responses unused for this many seconds are deleted
+
+# --- PROMPT TEMPLATES ---
+BASE_PROMPT_TMPL = (
+    "Create a detailed full-body image of: {character_desc}. "
+    "This character will appear in multiple educational contexts. "
+    "Focus on distinctive features that will remain consistent. "
+    "Style: Bright, clear educational illustration, suitable for children."
+)
+
+CONCEPT_PROMPT_TMPL = """Create an educational illustration showing {concept}.
+IMPORTANT CHARACTER GUIDELINES:
+1. Use the provided character image as exact reference.
+2. Maintain ALL physical features of the character (appearance, clothing, style).
+3. The character should be prominently featured in the scene.
+4. Keep the character's proportions and style consistent.
+SCENE REQUIREMENTS:
+- Style: Clear educational diagram with bright colors
+- Make the concept easy to understand for students
+- Include labeled elements and simple explanations
+- Ensure the character is actively involved in demonstrating the concept
+QUALITY CHECK:
+- Verify all elements accurately represent the concept
+- Ensure educational accuracy in diagrams and labels"""
+
+FIX_PROMPT_TMPL = """You are an expert educational illustrator.
+You have been given an image of {concept} that needs corrections.
+Apply these specific fixes:
+{fix_instructions}
+IMPORTANT:
+1. Keep the main character from the original image (use it as a reference).
+2. Maintain all physical features of the character.
+3. Only change what is necessary to fix the listed issues.
+4. Ensure the final image is a clear, accurate educational diagram."""
+
+EDIT_PROMPT_TMPL = """You are an expert educational illustrator.
+You have been given the following image of {concept}.
+Apply these edits to the image:
+{edit_prompt}
+IMPORTANT INSTRUCTIONS:
+1. Keep the main character from the original image (use it as a reference).
+2. Maintain all physical features of the character (appearance, clothing, style).
+3. Make the requested changes clearly visible and relevant to the educational concept.
+4. Ensure the final image remains a clear educational diagram."""
+
+ANALYSIS_PROMPT_TMPL = """You are an expert educational content reviewer specializing in K-12 education.
+
+STEP 1 - CONCEPT UNDERSTANDING:
+First, understand the core elements of "{user_concept}" that students need to learn:
+- Key principles and components
+- Standard terminology
+- Common misconceptions to avoid
+
+STEP 2 - IMAGE ANALYSIS:
+Analyze the provided image for these specific aspects:
+
+1. Scientific Accuracy:
+- Correct representation of processes/concepts
+- Accurate proportions and relationships
+- Valid scientific principles
+- Incorrect spelling should be corrected (e.g., 'photosynthasis' to 'P H O T O S Y N T H E S I S')
+
+2. Educational Clarity:
+- Age-appropriate explanations
+- Clear visual hierarchy
+- Logical flow of information
+
+3. Technical Elements:
+- Spelling and grammar in labels/text
+- Proper placement of labels
+- Visibility and readability of text
+
+4. Character Integration:
+- Character's relevance to concept
+- Proper demonstration of principles
+- Educational engagement level
+
+RESPONSE FORMAT:
+Return a JSON list of specific, actionable fixes. Each fix should be clear and implementable.
+Examples: 
+["Fix spelling: "PHOTOSTHNESIS" → "PHOTOSYNTHESIS", "GUGAR" → "SUGAR", "Dixoide" → "Dioxide", "Chlorojhplll" → "Chlorophyll",
+Correct chemical equation: "6CO₂ + 6H₂O + Light Energy → C₆H₁₂O₆ + 6O₂",
+Add "Chlorophyll" as a key component in the process,
+Fix arrow directions: Water should go up from roots, glucose should go out from leaves,
+Clarify that the process happens in chloroplasts within the leaves,
+Mathematical correction: "2 x 5 = 8 → 2 x 5 = 10"]
+
+IMPORTANT: Return ONLY the JSON list. No other text or explanation.
+If the image is perfect, return an empty list: []"""
+
+# --- IMAGE STORE ---
+
+@functools.lru_cache(maxsize=64)
+def image_digest(img_data):
+    """
+    Returns the sha256 hex digest of image bytes.
+    Memoized so the same image (e.g. the base character, referenced by every request)
+    is hashed once per run rather than once per cache key, store write and disk save.
+    """
+    return hashlib.sha256(img_data).hexdigest()
+
+def put_image(img_data):
+    """
+    Adds image bytes to the session's content-addressed store and returns their sha256 digest.
+    Identical images share a single copy; concept_images maps concept names to these digests.
+    """
+    digest = image_digest(img_data)
+    st.session_state.blobs.setdefault(digest, img_data)
+    return digest
+
+def get_image(digest):
+    """
+    Returns the image bytes stored under a digest from put_image.
+    """
+    return st.session_state.blobs[digest]
+
+def prune_images():
+    """
+    Drops stored images (and their thumbnails) that neither a concept nor the base character refers to,
+    so regenerating or re-editing a scene doesn't grow session memory.
+    """
+    live = set(st.session_state.concept_images.values())
+    if st.session_state.base_character:
+        live.add(image_digest(st.session_state.base_character))
+    for digest in [d for d in st.session_state.blobs if d not in live]:
+        del st.session_state.blobs[digest]
+        st.session_state.thumbs.pop(digest, None)
+
+def set_concept_image(concept, img_data):
+    """
+    Stores img_data as the scene for concept and returns its digest.
+    """
+    previous = st.session_state.concept_images.get(concept)
+    digest = put_image(img_data)
+    st.session_state.concept_images[concept] = digest
+    if previous and previous != digest:
+        prune_images()
+    return digest
+
+def set_base_character(img_data, description):
+    """
+    Stores the base character through the image store, so it is kept and released
+    by the same prune_images bookkeeping as the scenes.
+    """
+    st.session_state.base_character = get_image(put_image(img_data))
+    st.session_state.character_description = description
+    prune_images()
+
+# --- DISK PERSISTENCE ---
+
+def write_file_atomic(path, data):
+    """
+    Writes bytes to path via a temporary file and os.replace, so readers see either the old or the new file.
+    """
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+def session_index_path():
+    """
+    Returns this browser's index file in CACHE_DIR.
+    The id lives in the ?sid= query parameter, so a reload restores the same session
+    while every other visitor gets (and only ever reads) their own index.
+    """
+    if 'cache_id' not in st.session_state:
+        sid = st.query_params.get("sid", "")
+        if not SESSION_ID_RE.fullmatch(sid):
+            sid = uuid.uuid4().hex
+            st.query_params["sid"] = sid
+        st.session_state.cache_id = sid
+    return CACHE_DIR / f"index-{st.session_state.cache_id}.json"
+
+def save_session_to_disk():
+    """
+    Writes the base character and concept images to CACHE_DIR so a page reload doesn't regenerate them.
+    Images are stored once per content digest; the session's index file maps names to digests
+    and is replaced atomically, so a concurrent reader never sees it half-written.
+    """
+    def _put(img_data, digest=None):
+        digest = digest or image_digest(img_data)
+        path = CACHE_DIR / f"{digest}.img"
+        if path.exists():
+            path.touch()  # Counts as recently written, so prune_disk_sessions spares it
+        else:
+            write_file_atomic(path, img_data)
+        return digest
+
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        index = {
+            "base_character": _put(st.session_state.base_character) if st.session_state.base_character else None,
+            "character_description": st.session_state.character_description,
+            "concept_images": {name: _put(get_image(digest), digest) for name, digest in st.session_state.concept_images.items()},
+        }
+        write_file_atomic(session_index_path(), json.dumps(index).encode("utf-8"))
+    except OSError as e:
+        st.warning(f"Could not save images to disk cache: {str(e)}")
+
+def restore_session_from_disk():
+    """
+    Repopulates session_state from the images saved by save_session_to_disk for this browser, if any.
+    """
+    try:
+        index_path = session_index_path()
+        if not index_path.exists():
+            return
+        index = json.loads(index_path.read_text(encoding="utf-8"))
+        if index.get("base_character"):
+            st.session_state.base_character = get_image(put_image((CACHE_DIR / f"{index['base_character']}.img").read_bytes()))
+            st.session_state.character_description = index.get("character_description", "")
+        st.session_state.concept_images = {
+            name: put_image((CACHE_DIR / f"{digest}.img").read_bytes())
+            for name, digest in index.get("concept_images", {}).items()
+        }
+    except (OSError, ValueError) as e:
+        st.warning(f"Could not restore images from disk cache: {str(e)}")
+
+def prune_disk_sessions():
+    """
+    Deletes session indexes older than SESSION_INDEX_MAX_AGE and the saved images no remaining index refers to.
+    Recently written images are spared, since their index may not have been replaced yet.
+    Best effort: files another session removes first are skipped.
+    """
+    now = time.time()
+    live = set()
+    for index_path in CACHE_DIR.glob("index-*.json"):
+        try:
+            if now - index_path.stat().st_mtime > SESSION_INDEX_MAX_AGE:
+                index_path.unlink()
+                continue
+            index = json.loads(index_path.read_text(encoding="utf-8"))
+            live.add(index.get("base_character"))
+            live.update(index.get("concept_images", {}).values())
+        except (OSError, ValueError):
+            continue
+    for path in CACHE_DIR.glob("*.img"):
+        try:
+            if path.stem not in live and now - path.stat().st_mtime > ORPHAN_IMAGE_GRACE:
+                path.unlink()
+        except OSError:
+            continue
+
+def prune_response_cache():
+    """
+    Deletes cached API responses unused for RESPONSE_CACHE_MAX_AGE, then the least recently used ones
+    until the rest fit in RESPONSE_CACHE_MAX_BYTES. Reads refresh an entry's mtime, so it tracks last use.
+    """
+    now = time.time()
+    entries = []
+    for path in [*RESPONSE_CACHE_DIR.glob("*.img"), *RESPONSE_CACHE_DIR.glob("*.json")]:
+        try:
+            stat = path.stat()
+            if now - stat.st_mtime > RESPONSE_CACHE_MAX_AGE:
+                path.unlink()
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+        except OSError:
+            continue
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= RESPONSE_CACHE_MAX_BYTES:
+            break
+        try:
+            path.unlink()
+        except OSError:
+            pass
+        total -= size
+
+def prune_disk_cache_if_due():
+    """
+    Runs prune_disk_sessions and prune_response_cache unless PRUNE_MARKER was touched within PRUNE_INTERVAL,
+    so new sessions don't each scan the whole cache before their first render.
+    """
+    try:
+        if time.time() - PRUNE_MARKER.stat().st_mtime < PRUNE_INTERVAL:
+            return
+    except OSError:
+        pass
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        PRUNE_MARKER.touch()  # Before pruning, so sessions starting meanwhile skip it
+    except OSError:
+        return
+    prune_disk_sessions()
+    prune_response_cache()
 
 # Configure page
 st.set_page_config(
@@ -35,26 +375,206 @@ if 'api_calls' not in st.session_state:
     st.session_state.api_calls = 0
 if 'concept_images' not in st.session_state:
     st.session_state.concept_images = {}
+if 'blobs' not in st.session_state:
+    st.session_state.blobs = {}
+if 'thumbs' not in st.session_state:
+    st.session_state.thumbs = {}
 if 'character_description' not in st.session_state:
     st.session_state.character_description = ""
+if 'image_cache' not in st.session_state:
+    st.session_state.image_cache = {}
+if 'review_cache' not in st.session_state:
+    st.session_state.review_cache = {}
+if 'restored_from_disk' not in st.session_state:
+    st.session_state.restored_from_disk = True
+    prune_disk_cache_if_due()
+    restore_session_from_disk()
+
+def get_client(api_key):
+    """
+    Builds the Gemini client once per API key and reuses it (and its HTTP sessions) across reruns.
+    Kept in session_state rather than st.cache_resource: each session drives client.aio from
+    its own event loop (see run_async), and pooled async connections can't be shared between loops.
+    """
+    cached = st.session_state.get('client_cache')
+    if cached is None or cached[0] != api_key:
+        cached = (api_key, genai.Client(api_key=api_key))
+        st.session_state.client_cache = cached
+    return cached[1]
 
 # API key setup
-api_key = st.text_input("Enter your Gemini API Key", type="password", help="Get a free API key at https://aistudio.google.com/app/apikey")
-if api_key:
+# Inside a form, typing doesn't rerun the script; the client is only built on submit
+with st.form("api_key_form"):
+    api_key = st.text_input("Enter your Gemini API Key", type="password", help="Get a free API key at https://aistudio.google.com/app/apikey")
+    submitted = st.form_submit_button("Configure")
+if submitted and api_key:
     try:
-        st.session_state.client = genai.Client(api_key=api_key)
-        st.success("API Key configured! Ready to create educational visuals.")
+        st.session_state.client = get_client(api_key)
     except Exception as e:
+        st.session_state.client = None
         st.error(f"API configuration error: {str(e)}")
+fresh_images = st.sidebar.checkbox(
+    "Generate fresh images",
+    help="Skip cached results and call the API again for prompts that were generated before"
+)
+if st.session_state.client:
+    st.success("API Key configured! Ready to create educational visuals.")
 else:
     st.warning("Please enter your Gemini API Key to proceed")
 
 # --- FUNCTION DEFINITIONS ---
 
-def generate_image(prompt, reference_image=None):
+def run_async(coro):
     """
-    Generates an image using the Gemini API.
+    Runs a coroutine to completion on this session's event loop (uvloop when installed).
+    The loop is kept in session_state so the client's pooled async connections stay usable across reruns.
+    Tasks left pending when coro raises (e.g. a Streamlit stop mid Generate All) are cancelled,
+    so they don't resume during a later, unrelated call.
+    """
+    if 'event_loop' not in st.session_state or st.session_state.event_loop.is_closed():
+        st.session_state.event_loop = uvloop.new_event_loop() if uvloop else asyncio.new_event_loop()
+    loop = st.session_state.event_loop
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def shrink_reference(image_bytes):
+    """
+    Downscales a reference image to REFERENCE_MAX_SIZE and re-encodes it as JPEG before it is sent to Gemini.
+    Small RGB JPEGs are passed through untouched to avoid a lossy re-encode.
+    """
+    image = Image.open(BytesIO(image_bytes))
+    too_large = image.size[0] > REFERENCE_MAX_SIZE[0] or image.size[1] > REFERENCE_MAX_SIZE[1]
+    if not too_large and image.format == "JPEG" and image.mode == "RGB":
+        return image_bytes
+    image.thumbnail(REFERENCE_MAX_SIZE, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffered = BytesIO()
+    image.save(buffered, format="JPEG", **JPEG_SAVE_OPTIONS)
+    return buffered.getvalue()
+
+@functools.lru_cache(maxsize=32)
+def reference_part(image_bytes):
+    """
+    Wraps a reference image as a request Part, downscaled by shrink_reference.
+    Memoized so a reference shared by several requests in a run (e.g. the base character
+    across Generate All pipelines) is shrunk and wrapped once.
+    """
+    return types.Part.from_bytes(data=shrink_reference(image_bytes), mime_type="image/jpeg")
+
+def compress_for_cache(img_data):
+    """
+    Transcodes a generated image (PNG from Gemini) to RGB JPEG before it is stored in the session.
+    Cuts session memory several-fold with no visible change for illustrations.
+    """
+    image = Image.open(BytesIO(img_data))
+    if image.format == "JPEG":
+        return img_data
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffered = BytesIO()
+    image.save(buffered, format="JPEG", **JPEG_SAVE_OPTIONS)
+    return buffered.getvalue()
+
+def response_cache_key(model, prompt, image_bytes=None, config_version=None):
+    """
+    Hashes (model, prompt, reference image digest) into the key for cached API responses.
+    The model is part of the key, so changing IMAGE_MODEL or REVIEW_MODEL invalidates old entries;
+    so is config_version when given, so responses produced under an older request config aren't reused.
+    """
+    key = {"m": model, "p": prompt, "r": image_digest(image_bytes or b"")}
+    if config_version is not None:
+        key["v"] = config_version
+    return hashlib.sha256(json.dumps(key).encode("utf-8")).hexdigest()
+
+def read_cached_response(cache_key, suffix):
+    """
+    Returns the response bytes saved on disk under cache_key, or None if there are none.
+    """
+    path = RESPONSE_CACHE_DIR / f"{cache_key}{suffix}"
+    try:
+        data = path.read_bytes()
+        path.touch()  # Marks the entry as recently used for prune_response_cache
+        return data
+    except OSError:
+        return None
+
+def write_cached_response(cache_key, suffix, data):
+    """
+    Saves response bytes on disk under cache_key. Failures only cost a future cache miss.
+    """
+    try:
+        RESPONSE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        write_file_atomic(RESPONSE_CACHE_DIR / f"{cache_key}{suffix}", data)
+    except OSError:
+        pass
+
+def image_cache_key(prompt, image_bytes=None):
+    """
+    Builds the cache key for an image generation request against IMAGE_MODEL.
+    """
+    return response_cache_key(IMAGE_MODEL, prompt, image_bytes)
+
+def memoize(cache, cache_key, value, max_size):
+    """
+    Stores value in a session memo dict as its newest entry, evicting the oldest entries past max_size.
+    """
+    cache.pop(cache_key, None)
+    cache[cache_key] = value
+    while len(cache) > max_size:
+        del cache[next(iter(cache))]
+
+def remember_image(cache_key, img_data):
+    """
+    Stores a generated image in the session memo and the disk cache.
+    """
+    if cache_key not in st.session_state.image_cache:
+        write_cached_response(cache_key, ".img", img_data)
+    memoize(st.session_state.image_cache, cache_key, img_data, IMAGE_CACHE_SIZE)
+
+def recall_image(cache_key):
+    """
+    Returns a previously generated image from the session memo or, failing that, the disk cache.
+    """
+    img_data = st.session_state.image_cache.get(cache_key)
+    if img_data is None:
+        img_data = read_cached_response(cache_key, ".img")
+        if img_data is not None:
+            memoize(st.session_state.image_cache, cache_key, img_data, IMAGE_CACHE_SIZE)
+    return img_data
+
+def forget_image(cache_key):
+    """
+    Drops a generated image from the session memo and the disk cache, so the next request for it calls the API.
+    """
+    st.session_state.image_cache.pop(cache_key, None)
+    try:
+        (RESPONSE_CACHE_DIR / f"{cache_key}.img").unlink(missing_ok=True)
+    except OSError:
+        pass
+
+def _inline_images(candidate):
+    """
+    Returns the inline image bytes of a response candidate's parts, in order, skipping text and empty parts.
+    """
+    return [
+        data for data in (getattr(getattr(part, 'inline_data', None), 'data', None) for part in candidate.content.parts)
+        if data
+    ]
+
+async def _generate_image_async(prompt, reference_image=None, fresh=False):
+    """
+    Generates an image using the async Gemini API.
     Handles both text-only prompts and prompts with a reference image.
+    Repeat requests for the same prompt and reference are served from the session memo or the disk cache,
+    unless fresh is set, in which case the cached image is dropped and replaced by a new one.
     """
     try:
         if not st.session_state.client:
@@ -63,6 +583,7 @@ def generate_image(prompt, reference_image=None):
         parts = []
         parts.append(types.Part.from_text(text=prompt))
 
+        image_bytes = None
         if reference_image is not None:
             try:
                 if isinstance(reference_image, bytes):
@@ -72,23 +593,24 @@ def generate_image(prompt, reference_image=None):
                 else:
                     raise ValueError("Reference image must be bytes or BytesIO object.")
 
-                image_part = types.Part(
-                    inline_data=types.Blob(
-                        mime_type="image/jpeg",
-                        data=image_bytes
-                    )
-                )
-                parts.append(image_part)
+                parts.append(reference_part(image_bytes))
             except Exception as img_prep_error:
+                image_bytes = None
                 st.warning(f"Could not prepare reference image: {img_prep_error}. Proceeding with text prompt only.")
 
+        cache_key = image_cache_key(prompt, image_bytes)
+        if fresh:
+            forget_image(cache_key)
+        cached = recall_image(cache_key)
+        if cached is not None:
+            return cached
+
         contents = [types.Content(role="user", parts=parts)]
-        generate_content_config = types.GenerateContentConfig(response_modalities=["IMAGE"])
 
-        response = st.session_state.client.models.generate_content(
+        response = await st.session_state.client.aio.models.generate_content(
             model=IMAGE_MODEL,
             contents=contents,
-            config=generate_content_config
+            config=IMAGE_CONFIG
         )
 
         if not response or not response.candidates:
@@ -97,85 +619,181 @@ def generate_image(prompt, reference_image=None):
         if not candidate.content or not candidate.content.parts:
             raise ValueError("No content parts in API response.")
 
-        for part in candidate.content.parts:
-            if hasattr(part, 'inline_data') and part.inline_data and hasattr(part.inline_data, 'data'):
-                return part.inline_data.data
-        raise ValueError("No image data found in response.")
+        images = _inline_images(candidate)
+        if not images:
+            raise ValueError("No image data found in response.")
+        img_data = compress_for_cache(images[0])
+        st.session_state.api_calls += 1
+        remember_image(cache_key, img_data)
+        return img_data
     except Exception as e:
         raise Exception(f"Image generation failed: {str(e)}")
 
-def analyze_image_and_get_fixes(image_data, user_concept):
+def generate_image(prompt, reference_image=None, fresh=False):
+    """
+    Generates an image using the Gemini API.
+    Synchronous wrapper around _generate_image_async for the button handlers.
+    """
+    return run_async(_generate_image_async(prompt, reference_image, fresh))
+
+async def _generate_batch_async(prompts, reference_bytes=None):
+    """
+    Asks for several illustrations in a single request, sending the reference image only once.
+    Each image is stored in the session memo under its own prompt, so the per-prompt path picks it up.
+    Images are matched to prompts by position only, so they are kept out of the disk cache.
+    Best effort: if the call fails or the model doesn't return exactly one image per prompt, nothing is stored.
+    """
+    try:
+        parts = []
+        if reference_bytes:
+            parts.append(reference_part(reference_bytes))
+        numbered = "\n\n".join(f"ILLUSTRATION {i}:\n{p}" for i, p in enumerate(prompts, start=1))
+        parts.append(types.Part.from_text(text=(
+            f"Generate {len(prompts)} separate illustrations, one image per request below, in the same order.\n\n"
+            f"{numbered}"
+        )))
+
+        response = await st.session_state.client.aio.models.generate_content(
+            model=IMAGE_MODEL,
+            contents=[types.Content(role="user", parts=parts)],
+            config=IMAGE_CONFIG
+        )
+        st.session_state.api_calls += 1
+        images = _inline_images(response.candidates[0])
+        if len(images) != len(prompts):
+            return
+        images = [compress_for_cache(img_data) for img_data in images]
+    except Exception:
+        return
+    for prompt, img_data in zip(prompts, images):
+        memoize(st.session_state.image_cache, image_cache_key(prompt, reference_bytes), img_data, IMAGE_CACHE_SIZE)
+
+def is_complete_jpeg(img_data):
+    """
+    Returns True if img_data starts with the JPEG SOI marker and ends with the EOI marker (ignoring zero padding).
+    A cheap truncation check: Image.verify() only re-reads a JPEG's header, so it accepts cut-off files.
+    """
+    return img_data[:3] == b"\xff\xd8\xff" and img_data.rstrip(b"\0").endswith(b"\xff\xd9")
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def prep_upload(raw_bytes):
+    """
+    Resizes an uploaded character image to fit 1024x1024 and re-encodes it as RGB JPEG.
+    Complete RGB JPEGs that already fit are returned as-is without a decode/encode round-trip;
+    truncated ones are decoded, which raises.
+    Cached on the upload's content, so reruns with the same file skip the PIL pipeline.
+    Returns (jpeg_bytes, was_resized).
+    Raises if the upload isn't a valid image, before any pixel data is decoded.
+    """
+    Image.open(BytesIO(raw_bytes)).verify()
+    # verify() leaves the image unusable, so reopen it for the real work
+    image = Image.open(BytesIO(raw_bytes))
+    max_size = (1024, 1024)
+    resized = image.size[0] > max_size[0] or image.size[1] > max_size[1]
+    if not resized and image.format == "JPEG" and image.mode == "RGB" and is_complete_jpeg(raw_bytes):
+        return raw_bytes, False
+    if resized:
+        image.thumbnail(max_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffered = BytesIO()
+    image.save(buffered, format="JPEG", **JPEG_SAVE_OPTIONS)
+    return buffered.getvalue(), resized
+
+def image_format(img_data):
+    """
+    Returns the st.image output_format matching the stored bytes (PNG from Gemini, JPEG otherwise).
+    """
+    return "PNG" if img_data[:8] == b"\x89PNG\r\n\x1a\n" else "JPEG"
+
+def show_image(img_data, caption):
+    """
+    Displays stored image bytes as-is, passing their format explicitly so Streamlit
+    doesn't sniff them with PIL or transcode them on every rerun.
+    """
+    st.image(img_data, caption=caption, output_format=image_format(img_data))
+
+@st.cache_resource(show_spinner=False)
+def load_example_images():
+    """
+    Reads the pre-generated example images once per process, in EXAMPLE_IMAGES order.
+    """
+    return [Path(path).read_bytes() for path, _ in EXAMPLE_IMAGES]
+
+def make_thumbnail(img_data):
+    """
+    Downscales image bytes to fit THUMB_SIZE and returns them as JPEG.
+    Pure PIL work, so it is safe to run in worker threads (PIL releases the GIL while decoding/encoding).
+    """
+    image = Image.open(BytesIO(img_data))
+    image.thumbnail(THUMB_SIZE, Image.Resampling.LANCZOS)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffered = BytesIO()
+    image.save(buffered, format="JPEG", quality=80)
+    return buffered.getvalue()
+
+def get_thumbnails(digests):
+    """
+    Returns gallery thumbnails for the given image digests, building any missing ones in parallel.
+    Thumbnails are kept in session_state keyed by digest, so each image is only downscaled once.
+    """
+    thumbs = st.session_state.thumbs
+    missing = [d for d in dict.fromkeys(digests) if d not in thumbs]
+    if missing:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for digest, thumb in zip(missing, executor.map(make_thumbnail, [get_image(d) for d in missing])):
+                thumbs[digest] = thumb
+    return [thumbs[d] for d in digests]
+
+def explain_error(e, tips):
+    """
+    Shows troubleshooting advice for a failed API call.
+    Rate-limit and model errors get specific hints; anything else lists the given tips.
+    """
+    message = str(e)
+    if RATE_LIMIT_RE.search(message):
+        st.info("You might have hit API rate limits (RPD/RPM/TPM). Check your plan or try again later.")
+    elif MODEL_ERROR_RE.search(message):
+        st.info("Verify you're using a model that supports image generation.")
+    else:
+        st.info("Try these fixes:")
+        st.markdown("\n".join(f"- {tip}" for tip in tips))
+
+async def _analyze_image_async(image_data, user_concept):
     """
     Uses an LLM to analyze the generated image and return a list of fixes needed.
     The LLM sees the image and the original concept to detect errors.
+    Successfully parsed reviews are cached per (model, prompt, image) in the session and on disk.
     """
     try:
         if not st.session_state.client:
             raise ValueError("API client not configured.")
 
         # Prepare image part for analysis
-        image_part = types.Part(
-            inline_data=types.Blob(
-                mime_type="image/jpeg",
-                data=image_data
-            )
-        )
+        image_part = types.Part.from_bytes(data=image_data, mime_type=f"image/{image_format(image_data).lower()}")
 
         # Create analysis prompt
-        analysis_prompt = f"""
-        You are an expert educational content reviewer specializing in K-12 education.
-
-        STEP 1 - CONCEPT UNDERSTANDING:
-        First, understand the core elements of "{user_concept}" that students need to learn:
-        - Key principles and components
-        - Standard terminology
-        - Common misconceptions to avoid
-
-        STEP 2 - IMAGE ANALYSIS:
-        Analyze the provided image for these specific aspects:
-
-        1. Scientific Accuracy:
-        - Correct representation of processes/concepts
-        - Accurate proportions and relationships
-        - Valid scientific principles
-        - Incorrect spelling should be corrected (e.g., 'photosynthasis' to 'P H O T O S Y N T H E S I S')
-
-        2. Educational Clarity:
-        - Age-appropriate explanations
-        - Clear visual hierarchy
-        - Logical flow of information
-
-        3. Technical Elements:
-        - Spelling and grammar in labels/text
-        - Proper placement of labels
-        - Visibility and readability of text
-
-        4. Character Integration:
-        - Character's relevance to concept
-        - Proper demonstration of principles
-        - Educational engagement level
-
-        RESPONSE FORMAT:
-        Return a JSON list of specific, actionable fixes. Each fix should be clear and implementable.
-        Examples: 
-        ["Fix spelling: "PHOTOSTHNESIS" → "PHOTOSYNTHESIS", "GUGAR" → "SUGAR", "Dixoide" → "Dioxide", "Chlorojhplll" → "Chlorophyll",
-        Correct chemical equation: "6CO₂ + 6H₂O + Light Energy → C₆H₁₂O₆ + 6O₂",
-        Add "Chlorophyll" as a key component in the process,
-        Fix arrow directions: Water should go up from roots, glucose should go out from leaves,
-        Clarify that the process happens in chloroplasts within the leaves,
-        Mathematical correction: "2 x 5 = 8 → 2 x 5 = 10"]
-
-        IMPORTANT: Return ONLY the JSON list. No other text or explanation.
-        If the image is perfect, return an empty list: []
-        """
+        analysis_prompt = ANALYSIS_PROMPT_TMPL.format(user_concept=user_concept)
+
+        cache_key = response_cache_key(REVIEW_MODEL, analysis_prompt, image_data, REVIEW_CONFIG_VERSION)
+        fixes = st.session_state.review_cache.get(cache_key)
+        if fixes is not None:
+            return list(fixes)
+        cached = read_cached_response(cache_key, ".json")
+        if cached is not None:
+            fixes = orjson.loads(cached)
+            memoize(st.session_state.review_cache, cache_key, fixes, REVIEW_CACHE_SIZE)
+            return list(fixes)
 
         # Call LLM for analysis
-        response = st.session_state.client.models.generate_content(
+        response = await st.session_state.client.aio.models.generate_content(
             model=REVIEW_MODEL,
             contents=[
                 types.Content(role="user", parts=[image_part]),
                 types.Content(role="user", parts=[types.Part.from_text(text=analysis_prompt)]),
             ],
+            config=REVIEW_CONFIG
         )
 
         if response.candidates and response.candidates[0].content.parts:
@@ -183,17 +801,11 @@ def analyze_image_and_get_fixes(image_data, user_concept):
 
             # Try to parse as JSON list
             try:
-                # Clean the output to make it valid JSON
-                cleaned_output = raw_output.strip()
-                if cleaned_output.startswith("```json"):
-                    cleaned_output = cleaned_output[7:]
-                if cleaned_output.endswith("```"):
-                    cleaned_output = cleaned_output[:-3]
-                cleaned_output = cleaned_output.strip()
-
-                fixes = json.loads(cleaned_output)
+                fixes = orjson.loads(raw_output)
                 if isinstance(fixes, list):
-                    return fixes
+                    write_cached_response(cache_key, ".json", orjson.dumps(fixes))
+                    memoize(st.session_state.review_cache, cache_key, fixes, REVIEW_CACHE_SIZE)
+                    return list(fixes)
                 else:
                     st.warning("LLM returned invalid JSON format. Assuming no fixes needed.")
                     return []
@@ -208,6 +820,82 @@ def analyze_image_and_get_fixes(image_data, user_concept):
         st.warning(f"Image analysis failed: {str(e)}")
         return []
 
+async def _concept_scene_async(concept, reference_image, log=None, aggressive_fix=False, fresh=False):
+    """
+    Runs the scene pipeline for one concept and returns the final image bytes:
+    generate the initial scene, have the reviewer check it, and re-generate with fixes if any were found.
+    Unless aggressive_fix is set, a review with only a few spelling fixes keeps the initial image
+    rather than paying for a full re-generation.
+    With fresh, the initial scene is generated anew instead of being served from the cache.
+    Progress messages are passed to log(message) when given.
+    """
+    log = log or (lambda message: None)
+
+    # --- STAGE 1: Generate Initial Image ---
+    initial_img_data = await _generate_image_async(CONCEPT_PROMPT_TMPL.format(concept=concept), reference_image, fresh)
+
+    # --- STAGE 2: Analyze Image for Errors ---
+    log("🔍 Reviewing image for errors...")
+    fixes = await _analyze_image_async(initial_img_data, concept)
+    if not fixes:
+        log("✅ Image is perfect! No corrections needed.")
+        return initial_img_data
+    if not aggressive_fix and len(fixes) <= MINOR_FIX_LIMIT and all(SPELLING_FIX_RE.match(str(fix)) for fix in fixes):
+        log(f"✏️ Minor textual issues flagged ({len(fixes)}); skipping costly re-generation.")
+        return initial_img_data
+    if isinstance(reference_image, bytes) and image_digest(initial_img_data) == image_digest(reference_image):
+        # The model echoed the reference back unchanged; fixing from it would just replay Stage 1.
+        # Only reachable when the base character is a <=768px RGB JPEG (sent as-is by shrink_reference)
+        # and the model returns those exact JPEG bytes (kept as-is by compress_for_cache); rare, since Gemini returns PNG.
+        log("⚠️ Reviewer flagged fixes but the initial image matches the base character; skipping re-generation.")
+        return initial_img_data
+
+    # --- STAGE 3: Re-Generate with Fixes ---
+    log(f"🔄 Found {len(fixes)} issue(s). Fixing errors and re-generating...")
+    fix_instructions = "\n".join([f"- {fix}" for fix in fixes])
+    fix_prompt = FIX_PROMPT_TMPL.format(concept=concept, fix_instructions=fix_instructions)
+    final_img_data = await _generate_image_async(fix_prompt, initial_img_data)
+    log("✅ Image reviewed and corrected!")
+    return final_img_data
+
+async def generate_scenes(concepts, reference_image, max_concurrency=5, on_result=None, log=None, aggressive_fix=False, batch_first=False, fresh=False):
+    """
+    Runs the scene pipeline for several concepts concurrently, at most max_concurrency at a time.
+    With batch_first, uncached Stage 1 prompts are first tried as one batched request (see _generate_batch_async);
+    off by default, since a batch the model doesn't answer one-image-per-prompt costs an extra call up front.
+    With fresh, cached Stage 1 images for these concepts are dropped first, so every scene is generated anew.
+    Returns a list aligned with concepts holding image bytes or the Exception raised for that concept.
+    If given, on_result(index, result) is called as each concept finishes, in completion order,
+    and log(concept, message) receives each pipeline's progress messages.
+    """
+    reference_bytes = reference_image.getvalue() if hasattr(reference_image, 'getvalue') else reference_image
+    prompts = [CONCEPT_PROMPT_TMPL.format(concept=c) for c in concepts]
+    if fresh:
+        for prompt in prompts:
+            forget_image(image_cache_key(prompt, reference_bytes))
+    if batch_first:
+        uncached = [p for p in prompts if recall_image(image_cache_key(p, reference_bytes)) is None]
+        if st.session_state.client and len(uncached) > 1:
+            await _generate_batch_async(uncached, reference_bytes)
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _limited(index, concept):
+        concept_log = (lambda message: log(concept, message)) if log else None
+        async with semaphore:
+            try:
+                return index, await _concept_scene_async(concept, reference_bytes, concept_log, aggressive_fix)
+            except Exception as e:
+                return index, e
+
+    results = [None] * len(concepts)
+    for next_done in asyncio.as_completed([_limited(i, c) for i, c in enumerate(concepts)]):
+        index, result = await next_done
+        results[index] = result
+        if on_result:
+            on_result(index, result)
+    return results
+
 # --- CHARACTER SETUP ---
 with st.expander("Character Setup", expanded=True):
     col1, col2 = st.columns(2)
@@ -226,47 +914,39 @@ with st.expander("Character Setup", expanded=True):
             else:
                 with st.spinner("Creating base character profile..."):
                     try:
-                        prompt = (
-                            f"Create a detailed full-body image of: {character_desc}. "
-                            f"This character will appear in multiple educational contexts. "
-                            f"Focus on distinctive features that will remain consistent. "
-                            f"Style: Bright, clear educational illustration, suitable for children."
-                        )
-                        img_data = generate_image(prompt)
-                        st.session_state.base_character = img_data
-                        st.session_state.character_description = character_desc
-                        st.session_state.api_calls += 1
+                        prompt = BASE_PROMPT_TMPL.format(character_desc=character_desc)
+                        img_data = generate_image(prompt, fresh=fresh_images)
+                        set_base_character(img_data, character_desc)
+                        save_session_to_disk()
                         st.success("Base character created!")
-                        st.image(img_data, caption="Base Character Profile")
+                        show_image(img_data, caption="Base Character Profile")
                     except Exception as e:
                         st.error(f"Error generating base character: {str(e)}")
-                        if "429" in str(e) or "quota" in str(e).lower():
-                            st.info("You might have hit API rate limits. Please check your plan or try again later.")
-                        elif "400" in str(e) and "model" in str(e).lower():
-                            st.info("Verify you're using a model that supports image generation.")
-                        else:
-                            st.info("Try these fixes:")
-                            st.markdown("- Verify your API key is correct")
-                            st.markdown("- Ensure character description is detailed enough")
+                        explain_error(e, [
+                            "Verify your API key is correct",
+                            "Ensure character description is detailed enough",
+                        ])
 
     with col2:
         uploaded_image = st.file_uploader("Upload your own character image", type=["jpg", "jpeg", "png"])
         if uploaded_image is not None:
             try:
-                image = Image.open(uploaded_image)
-                max_size = (1024, 1024)
-                if image.size[0] > max_size[0] or image.size[1] > max_size[1]:
-                    image.thumbnail(max_size)
+                raw_bytes = uploaded_image.getvalue()
+                if len(raw_bytes) <= UPLOAD_PASSTHROUGH_BYTES and is_complete_jpeg(raw_bytes):
+                    # Small, complete JPEGs are used as-is: no pixel decode, no re-encode, no cache copy.
+                    # Truncated ones go through prep_upload, whose decode rejects them.
+                    # Oversized dimensions are still handled by shrink_reference before any API call.
+                    Image.open(BytesIO(raw_bytes)).verify()
+                    img_bytes, resized = raw_bytes, False
+                else:
+                    img_bytes, resized = prep_upload(raw_bytes)
+                if resized:
                     st.warning("Image was resized to meet potential size requirements")
-                if image.mode != 'RGB':
-                    image = image.convert('RGB')
-                buffered = BytesIO()
-                image.save(buffered, format="JPEG")
-                img_bytes = buffered.getvalue()
-                st.session_state.base_character = img_bytes
-                st.session_state.character_description = "Uploaded character image"
+                if st.session_state.base_character != img_bytes:
+                    set_base_character(img_bytes, "Uploaded character image")
+                    save_session_to_disk()
                 st.success("Character image uploaded successfully!")
-                st.image(image, caption="Uploaded Character")
+                show_image(img_bytes, caption="Uploaded Character")
             except Exception as e:
                 st.error(f"Error processing image: {str(e)}")
                 st.info("Please upload a valid JPG, JPEG, or PNG file")
@@ -287,6 +967,14 @@ if st.session_state.base_character:
     )
     custom_concept = st.text_input("Or enter your own concept")
     concept = custom_concept if custom_concept else selected_concept
+    aggressive_fix = st.checkbox(
+        "Aggressive fix (costs 1 extra API call)",
+        help=f"Re-generate even when the reviewer only flags up to {MINOR_FIX_LIMIT} spelling fixes"
+    )
+    batch_first = st.checkbox(
+        "Try one batched request first",
+        help="Generate All first asks for every scene in a single call; if the model doesn't return one image per concept, that call is wasted"
+    )
 
     if st.button("Generate Concept Scene", type="primary", key="gen_scene_btn"):
         if not st.session_state.client:
@@ -296,96 +984,92 @@ if st.session_state.base_character:
         elif not concept.strip():
             st.error("Please select or enter an educational concept.")
         else:
-            with st.spinner(f"🎨 Creating initial {concept} scene..."):
-                try:
-                    # --- STAGE 1: Generate Initial Image ---
-                    initial_prompt = f"""Create an educational illustration showing {concept}.
-                    IMPORTANT CHARACTER GUIDELINES:
-                    1. Use the provided character image as exact reference.
-                    2. Maintain ALL physical features of the character (appearance, clothing, style).
-                    3. The character should be prominently featured in the scene.
-                    4. Keep the character's proportions and style consistent.
-                    SCENE REQUIREMENTS:
-                    - Style: Clear educational diagram with bright colors
-                    - Make the concept easy to understand for students
-                    - Include labeled elements and simple explanations
-                    - Ensure the character is actively involved in demonstrating the concept
-                    QUALITY CHECK:
-                    - Verify all elements accurately represent the concept
-                    - Ensure educational accuracy in diagrams and labels"""
-
-                    initial_img_data = generate_image(initial_prompt, st.session_state.base_character)
-                    st.session_state.api_calls += 1
-
-                    # --- STAGE 2: Analyze Image for Errors ---
-                    with st.spinner("🔍 Reviewing image for errors..."):
-                        fixes = analyze_image_and_get_fixes(initial_img_data, concept)
-
-                        if fixes:
-                            st.info(f"Found {len(fixes)} issue(s). Applying fixes...")
-                            # --- STAGE 3: Re-Generate with Fixes ---
-                            with st.spinner("🔄 Fixing errors and re-generating..."):
-                                fix_instructions = "\n".join([f"- {fix}" for fix in fixes])
-                                fix_prompt = f"""You are an expert educational illustrator.
-                                You have been given an image of {concept} that needs corrections.
-                                Apply these specific fixes:
-                                {fix_instructions}
-                                IMPORTANT:
-                                1. Keep the main character from the original image (use it as a reference).
-                                2. Maintain all physical features of the character.
-                                3. Only change what is necessary to fix the listed issues.
-                                4. Ensure the final image is a clear, accurate educational diagram."""
-
-                                final_img_data = generate_image(fix_prompt, initial_img_data)
-                                st.session_state.concept_images[concept] = final_img_data
-                                st.session_state.api_calls += 1
-                                st.success("✅ Image reviewed and corrected!")
+            try:
+                with st.status(f"🎨 Creating {concept} scene...", expanded=True) as status:
+                    final_img_data = run_async(_concept_scene_async(concept, st.session_state.base_character, status.write, aggressive_fix, fresh_images))
+                    set_concept_image(concept, final_img_data)
+                    save_session_to_disk()
+                    status.update(label=f"{concept} scene ready", state="complete")
+
+                # Display results
+                col1, col2 = st.columns(2)
+                with col1:
+                    show_image(st.session_state.base_character, caption="Base Character")
+                with col2:
+                    show_image(get_image(st.session_state.concept_images[concept]), caption=f"{concept} Scene")
+
+            except Exception as e:
+                st.error(f"Error generating scene: {str(e)}")
+                explain_error(e, [
+                    "Verify your API key is correct",
+                    "Reduce complexity of prompts",
+                    "Wait a few minutes and try again",
+                ])
+
+    if st.button("Generate All Concepts", key="gen_all_btn", help=f"Generates all {len(concept_options)} listed concepts at once"):
+        if not st.session_state.client:
+            st.error("Please configure your API key first")
+        else:
+            failed, done = [], []
+            try:
+                with st.status(f"🎨 Creating {len(concept_options)} concept scenes in parallel...", expanded=True) as status:
+
+                    def _show_progress(index, result):
+                        # Runs inside the event loop, so the one thumbnail is built inline rather than via a thread pool
+                        c = concept_options[index]
+                        if isinstance(result, Exception):
+                            failed.append(c)
+                            status.write(f"❌ {c}: {str(result)}")
                         else:
-                            st.success("✅ Image is perfect! No corrections needed.")
-                            st.session_state.concept_images[concept] = initial_img_data
-
-                    # Display results
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.image(st.session_state.base_character, caption="Base Character")
-                    with col2:
-                        st.image(st.session_state.concept_images[concept], caption=f"{concept} Scene")
-
-                except Exception as e:
-                    st.error(f"Error generating scene: {str(e)}")
-                    if "429" in str(e) or "quota" in str(e).lower():
-                        st.info("You might have hit API rate limits (RPD/RPM/TPM). Check your plan or try again later.")
-                    elif "400" in str(e) and "model" in str(e).lower():
-                        st.info("Verify you're using a model that supports image generation.")
-                    else:
-                        st.info("Try these fixes:")
-                        st.markdown("- Verify your API key is correct")
-                        st.markdown("- Reduce complexity of prompts")
-                        st.markdown("- Wait a few minutes and try again")
+                            digest = set_concept_image(c, result)
+                            done.append(c)
+                            status.write(f"✅ {c}")
+                            if digest not in st.session_state.thumbs:
+                                st.session_state.thumbs[digest] = make_thumbnail(result)
+                            show_image(st.session_state.thumbs[digest], caption=c)
+
+                    run_async(generate_scenes(
+                        concept_options,
+                        st.session_state.base_character,
+                        on_result=_show_progress,
+                        log=lambda c, message: status.write(f"{c}: {message}"),
+                        aggressive_fix=aggressive_fix,
+                        batch_first=batch_first,
+                        fresh=fresh_images
+                    ))
+                    status.update(
+                        label=f"Created {len(done)} of {len(concept_options)} concept scenes",
+                        state="error" if failed else "complete",
+                        expanded=bool(failed)
+                    )
+            except Exception as e:
+                st.error(f"Error generating scenes: {str(e)}")
+                explain_error(e, [
+                    "Verify your API key is correct",
+                    "Reduce complexity of prompts",
+                    "Wait a few minutes and try again",
+                ])
+            if done:
+                save_session_to_disk()
+                st.success(f"✅ Created {len(done)} concept scene(s)! See the gallery below.")
 
 # --- GALLERY ---
 if st.session_state.concept_images:
     st.subheader("Your Generated Concepts Gallery")
     st.markdown("See how your character appears across different concepts:")
-    concept_list = []
-    for concept in st.session_state.concept_images.keys():
-        if concept.startswith("Edited_"):
-            original_concept = concept[7:]
-            if original_concept not in concept_list:
-                concept_list.append(original_concept)
-            concept_list.append(concept)
-        else:
-            if concept not in concept_list:
-                concept_list.append(concept)
-    for i in range(0, len(concept_list), 2):
-        cols = st.columns(2)
-        with cols[0]:
-            concept = concept_list[i]
-            st.image(st.session_state.concept_images[concept], caption=concept)
-        if i + 1 < len(concept_list):
-            with cols[1]:
-                concept = concept_list[i + 1]
-                st.image(st.session_state.concept_images[concept], caption=concept)
+    # Each edited scene is preceded by its original; dict.fromkeys dedups in O(1) per name, keeping order
+    concept_list = list(dict.fromkeys(
+        name
+        for concept in st.session_state.concept_images
+        for name in ((concept[7:], concept) if concept.startswith("Edited_") else (concept,))
+        if name in st.session_state.concept_images
+    ))
+    thumbs = get_thumbnails([st.session_state.concept_images[c] for c in concept_list])
+    for i in range(0, len(concept_list), GALLERY_COLUMNS):
+        row = zip(st.columns(GALLERY_COLUMNS), concept_list[i:i + GALLERY_COLUMNS], thumbs[i:i + GALLERY_COLUMNS])
+        for col, concept, thumb in row:
+            with col:
+                show_image(thumb, caption=concept)
 
 # --- IMAGE EDITING ---
 if st.session_state.concept_images and st.session_state.base_character:
@@ -396,7 +1080,7 @@ if st.session_state.concept_images and st.session_state.base_character:
         concepts_to_edit,
         index=0
     )
-    current_image_data = st.session_state.concept_images[selected_concept_for_edit]
+    current_image_data = get_image(st.session_state.concept_images[selected_concept_for_edit])
     
     # Create container for images
     image_container = st.container()
@@ -408,10 +1092,10 @@ if st.session_state.concept_images and st.session_state.base_character:
     with image_container:
         col1, col2 = st.columns(2)
         with col1:
-            st.image(current_image_data, caption=f"Original {selected_concept_for_edit} Scene")
+            show_image(current_image_data, caption=f"Original {selected_concept_for_edit} Scene")
         with col2:
             if f"Edited_{selected_concept_for_edit}" in st.session_state.concept_images:
-                st.image(st.session_state.concept_images[f"Edited_{selected_concept_for_edit}"], 
+                show_image(get_image(st.session_state.concept_images[f"Edited_{selected_concept_for_edit}"]), 
                         caption=f"Edited {selected_concept_for_edit} Scene")
             else:
                 st.info("Edited version will appear here")
@@ -425,23 +1109,17 @@ if st.session_state.concept_images and st.session_state.base_character:
         )
         
         if st.button("Apply Edits", type="primary"):
-            if not edit_prompt.strip():
+            if not st.session_state.client:
+                st.error("Please configure your API key first")
+            elif not edit_prompt.strip():
                 st.error("Please enter an edit description.")
             else:
                 with st.spinner(f"Applying edits to {selected_concept_for_edit} scene..."):
                     try:
-                        full_prompt = f"""You are an expert educational illustrator.
-                        You have been given the following image of {selected_concept_for_edit}.
-                        Apply these edits to the image:
-                        {edit_prompt}
-                        IMPORTANT INSTRUCTIONS:
-                        1. Keep the main character from the original image (use it as a reference).
-                        2. Maintain all physical features of the character (appearance, clothing, style).
-                        3. Make the requested changes clearly visible and relevant to the educational concept.
-                        4. Ensure the final image remains a clear educational diagram."""
-                        edited_img_data = generate_image(full_prompt, current_image_data)
-                        st.session_state.concept_images[f"Edited_{selected_concept_for_edit}"] = edited_img_data
-                        st.session_state.api_calls += 1
+                        full_prompt = EDIT_PROMPT_TMPL.format(concept=selected_concept_for_edit, edit_prompt=edit_prompt)
+                        edited_img_data = generate_image(full_prompt, current_image_data, fresh=fresh_images)
+                        set_concept_image(f"Edited_{selected_concept_for_edit}", edited_img_data)
+                        save_session_to_disk()
                         st.success("Edits applied successfully!")
                         # Force rerun to update the image in the right column
                         st.rerun()
@@ -454,20 +1132,12 @@ with st.expander("Pre-generated Examples (For Submission Verification)"):
     **Important for judges**: These examples demonstrate our implementation concept when API calls are limited.
     They show the intended character consistency feature.
     """)
-    example_col1, example_col2, example_col3  = st.columns(3)
-    with example_col1:
-        st.image("./GeneratedImages/BaseImage1.jpg", caption="Base Character 1")
-    with example_col2:
-        st.image("./GeneratedImages/GeneratedImage1-3.jpg", caption="Human Digestive System")
-    with example_col3:
-        st.image("./GeneratedImages/GeneratedImage1-4.jpg", caption="Newton's Laws of Motion")
-    example_col4, example_col5, example_col6 = st.columns(3)
-    with example_col4:
-        st.image("./GeneratedImages/BaseImage2.jpg", caption="Base Character 2")
-    with example_col5:
-        st.image("./GeneratedImages/GeneratedImage2-1.jpg", caption="Water Cycle Scene")
-    with example_col6:
-        st.image("./GeneratedImages/GeneratedImage2-2.jpg", caption="Ancient Roman Marketplace")
+    examples = load_example_images()
+    for i in range(0, len(EXAMPLE_IMAGES), 3):
+        row = zip(st.columns(3), EXAMPLE_IMAGES[i:i + 3], examples[i:i + 3])
+        for col, (_, caption), img_data in row:
+            with col:
+                show_image(img_data, caption=caption)
 
 # --- FOOTER ---
 st.markdown("---")